@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Exaplanation: sumologic_benchmark runs reproducible microbenchmarks of the export hot paths
+
+Usage:
+    $ python  sumologic_benchmark [ options ]
+
+    The API is served by a local stub server and the PDF fixtures are generated on the fly,
+    so no Sumo Logic credentials or network access are needed.
+
+Style:
+    Google Python Style Guide:
+    http://google.github.io/styleguide/pyguide.html
+
+    @name           sumologic_benchmark
+    @version        2.00
+    @author-name    Wayne Schmidt
+    @author-email   wschmidt@sumologic.com
+    @license-name   Apache 2.0
+    @license-url    https://www.apache.org/licenses/LICENSE-2.0
+"""
+
+__version__ = 2.00
+__author__ = "Wayne Schmidt (wschmidt@sumologic.com)"
+
+### beginning ###
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import hashlib
+import statistics
+import threading
+import http.server
+import socketserver
+import urllib.parse
+
+sys.dont_write_bytecode = 1
+
+PARSER = argparse.ArgumentParser(description="""
+sumologic_benchmark times the API request/parse path, export job polling and PDF rasterizing
+""")
+
+PARSER.add_argument("-r", type=int, default=20, metavar='<rounds>', \
+                    dest='ROUNDS', help="set timed rounds per benchmark")
+
+PARSER.add_argument("-k", metavar='<filter>', dest='FILTER', \
+                    help="only run benchmarks whose name contains this string")
+
+PARSER.add_argument("-o", metavar='<jsonfile>', dest='OUTPUT', \
+                    help="save results as JSON")
+
+PARSER.add_argument("-b", metavar='<jsonfile>', dest='BASELINE', \
+                    help="compare medians against saved results")
+
+PARSER.add_argument("-t", type=float, default=0.10, metavar='<tolerance>', \
+                    dest='TOLERANCE', help="set allowed median slowdown against the baseline")
+
+PARSER.add_argument("-s", action='store_true', default=False, dest='S3CHECK', \
+                    help="check and time the S3 sink against a local S3 stand-in")
+
+ARGS = PARSER.parse_args()
+
+BINDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+
+sys.path.insert(0, BINDIR)
+
+os.environ.setdefault('SUMO_UID', 'benchmark')
+os.environ.setdefault('SUMO_KEY', 'benchmark')
+
+sys.argv = [ sys.argv[0], '-s', '0', '-p', 'none' ]
+
+# pylint: disable=wrong-import-position
+import pdf2image
+import sumologic_dashboard_export as export_script
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+DASHBOARD_COUNTS = ( 10, 100, 1000 )
+
+POLL_COUNTS = ( 1, 5 )
+
+PAGE_COUNTS = ( 1, 5, 20 )
+
+DPI_LEVELS = ( 72, 150, 200 )
+
+### beginning ###
+
+### stub ###
+class StubServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Local stand-in for the dashboard API: listing, report job start, status and result
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        self.dashboards = b''
+        self.pdf = b''
+        self.pending_polls = 0
+        self.jobs = {}
+        self.lock = threading.Lock()
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+
+    def set_dashboards(self, count):
+        """
+        Set the number of dashboards returned by the listing
+        """
+        dashboards = [ {"id": f'{number:016X}', "title": f'Dashboard {number}', \
+                        "folderId": '0000000000000001', "contentId": f'{number:016X}', \
+                        "panels": [ {"id": str(panel), "title": f'Panel {panel}'} \
+                                    for panel in range(8) ]} for number in range(count) ]
+        self.dashboards = json.dumps({"dashboards": dashboards}).encode('utf8')
+
+    @property
+    def endpoint(self):
+        """
+        Return the API endpoint of the stub
+        """
+        return f'http://127.0.0.1:{self.server_address[1]}/api'
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Request handler for the stub server, using keep-alive like the real API
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+        Serve the listing, job status and job result
+        """
+        if self.path.startswith('/api/v2/dashboards/reportJobs/'):
+            job_id = self.path.split('/')[5]
+            if self.path.endswith('/status'):
+                with self.server.lock:
+                    self.server.jobs[job_id] = self.server.jobs.get(job_id, 0) + 1
+                    polls = self.server.jobs[job_id]
+                status = 'Success' if polls > self.server.pending_polls else 'InProgress'
+                self.reply(json.dumps({"status": status}).encode('utf8'))
+            else:
+                self.reply(self.server.pdf, 'application/pdf')
+        elif self.path.startswith('/api/v2/dashboards'):
+            self.reply(self.server.dashboards)
+        else:
+            self.reply(b'{}', status=404)
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """
+        Start a report job
+        """
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            job_id = f'job{len(self.server.jobs)}'
+            self.server.jobs[job_id] = 0
+        self.reply(json.dumps({"id": job_id}).encode('utf8'))
+
+    def reply(self, payload, content_type='application/json', status=200, headers=None):
+        """
+        Send a complete response
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+class S3StubServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Local stand-in for S3 compatible storage (MinIO style, path style addressing):
+    put object, multipart upload (create, upload part, complete), head object and get object
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0), S3StubHandler)
+
+    @property
+    def endpoint(self):
+        """
+        Return the endpoint URL of the stub
+        """
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+class S3StubHandler(StubHandler):
+    """
+    Request handler for the S3 stub server
+    """
+    def read_body(self):
+        """
+        Read the request body, decoding aws-chunked bodies sent with checksum trailers
+        """
+        if self.headers.get('Transfer-Encoding') == 'chunked' or \
+           'aws-chunked' in self.headers.get('Content-Encoding', ''):
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b'\r\n', b''):
+                        pass
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_PUT(self): # pylint: disable=invalid-name
+        """
+        Store an object or one part of a multipart upload
+        """
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        body = self.read_body()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self.server.lock:
+            if 'uploadId' in query:
+                parts = self.server.uploads[query['uploadId'][0]]
+                parts[int(query['partNumber'][0])] = body
+            else:
+                self.server.objects[url.path] = body
+        self.reply(b'', headers={'ETag': etag})
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """
+        Create or complete a multipart upload
+        """
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        self.read_body()
+        (bucket, _sep, key) = url.path.lstrip('/').partition('/')
+        with self.server.lock:
+            if 'uploads' in query:
+                upload_id = f'upload{len(self.server.uploads)}'
+                self.server.uploads[upload_id] = {}
+                element = 'InitiateMultipartUploadResult'
+                detail = f'<UploadId>{upload_id}</UploadId>'
+            else:
+                parts = self.server.uploads.pop(query['uploadId'][0])
+                self.server.objects[url.path] = b''.join(parts[number] \
+                                                         for number in sorted(parts))
+                element = 'CompleteMultipartUploadResult'
+                detail = '<ETag>"multipart"</ETag>'
+        payload = f'<?xml version="1.0" encoding="UTF-8"?><{element}><Bucket>{bucket}' + \
+                  f'</Bucket><Key>{key}</Key>{detail}</{element}>'
+        self.reply(payload.encode('utf8'), 'application/xml')
+
+    def do_HEAD(self): # pylint: disable=invalid-name
+        """
+        Report whether an object is stored
+        """
+        path = urllib.parse.urlparse(self.path).path
+        with self.server.lock:
+            stored = path in self.server.objects
+        self.send_response(200 if stored else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+        Return a stored object
+        """
+        path = urllib.parse.urlparse(self.path).path
+        with self.server.lock:
+            payload = self.server.objects.get(path)
+        if payload is None:
+            self.reply(b'', 'application/xml', status=404)
+        else:
+            self.reply(payload, 'application/octet-stream')
+
+### stub ###
+
+### fixtures ###
+def build_fixture_pages(pages, dpi=72):
+    """
+    Draw deterministic landscape letter pages resembling a dashboard export
+    """
+    images = []
+    for number in range(pages):
+        image = Image.new('RGB', (792, 612), 'white')
+        draw = ImageDraw.Draw(image)
+        for panel in range(6):
+            left = 24 + (panel % 3) * 252
+            top = 40 + (panel // 3) * 280
+            draw.rectangle((left, top, left + 240, top + 260), outline='gray')
+            points = [ (left + 10 + step * 11, top + 240 - ((step * 37 + panel * 11 + \
+                        number * 7) % 200)) for step in range(20) ]
+            draw.line(points, fill='blue', width=2)
+            draw.text((left + 10, top + 10), f'Page {number} Panel {panel}', fill='black')
+        if dpi != 72:
+            image = image.resize((792 * dpi // 72, 612 * dpi // 72))
+        images.append(image)
+    return images
+
+def build_fixture_pdf(pages):
+    """
+    Build a deterministic multi page PDF resembling a dashboard export
+    """
+    images = build_fixture_pages(pages)
+    buffer = io.BytesIO()
+    images[0].save(buffer, 'PDF', save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+### fixtures ###
+
+### runner ###
+def benchmark(results, name, function, setup=None, rounds=None):
+    """
+    Time one benchmark: one warm up call, then rounds timed calls of function(setup())
+    """
+    if ARGS.FILTER and ARGS.FILTER not in name:
+        return
+    rounds = rounds or ARGS.ROUNDS
+    setup = setup or (lambda: None)
+    function(setup())
+    timings = []
+    for _round in range(rounds):
+        argument = setup()
+        started = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - started)
+    results[name] = {
+        "rounds": rounds,
+        "min": min(timings),
+        "max": max(timings),
+        "mean": statistics.mean(timings),
+        "median": statistics.median(timings),
+        "stddev": statistics.stdev(timings) if rounds > 1 else 0.0
+    }
+    stats = results[name]
+    print(f'{name:<40} {stats["min"] * 1000:>10.3f} {stats["median"] * 1000:>10.3f} ' + \
+          f'{stats["mean"] * 1000:>10.3f} {stats["stddev"] * 1000:>10.3f} ' + \
+          f'{1 / stats["median"] if stats["median"] else 0:>10.1f}')
+
+def compare_baseline(results, baselinefile, tolerance):
+    """
+    Report benchmarks whose median is slower than the baseline by more than the tolerance
+    """
+    with open(baselinefile, 'r', encoding='utf8') as fileobject:
+        baseline = json.load(fileobject)
+    regressions = 0
+    for name, stats in sorted(results.items()):
+        if name not in baseline:
+            continue
+        change = stats['median'] / baseline[name]['median'] - 1
+        marker = 'REGRESSION' if change > tolerance else 'ok'
+        regressions += change > tolerance
+        print(f'{name:<40} {change * 100:>+8.1f}% {marker}')
+    return regressions
+
+def check_s3_sink(results):
+    """
+    Write small, multipart and streamed artifacts through the S3 sink into the S3 stand-in,
+    check that every object arrives intact, then time the sink; return the failure count
+    """
+    server = S3StubServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for name, value in ( ('S3_ACCESS_KEY', 'benchmark'), ('S3_SECRET_KEY', 'benchmark'), \
+                         ('S3_REGION', 'us-east-1') ):
+        os.environ.setdefault(name, value)
+    chunksize = 5 * 1024 * 1024
+    sink = export_script.S3Sink('benchmark', 'exports', endpoint=server.endpoint, \
+                                chunksize=chunksize)
+    payloads = {
+        "small.pdf": os.urandom(64 * 1024),
+        "multipart.pdf": os.urandom(chunksize * 2 + 1024),
+        "stream.data.ndjson": b''.join(b'{"row": %d}\n' % row for row in range(100000))
+    }
+    sink.write('small.pdf', payloads['small.pdf'])
+    sink.write('multipart.pdf', payloads['multipart.pdf'])
+    with sink.open_stream('stream.data.ndjson') as fileobject:
+        fileobject.write(payloads['stream.data.ndjson'])
+    sink.flush()
+    failures = 0
+    if not sink.exists('small.pdf') or sink.exists('missing.pdf'):
+        failures += 1
+        print('S3 Sink Check: exists FAILED')
+    for name, payload in payloads.items():
+        stored = server.objects.get(f'/benchmark/exports/{name}')
+        status = 'ok' if stored == payload else 'FAILED'
+        failures += stored != payload
+        print(f'S3 Sink Check: {sink.location(name)} bytes: {len(payload)} {status}')
+
+    page = os.urandom(256 * 1024)
+    def write_pages(count):
+        for number in range(count):
+            sink.write(f'page.{number}.jpg', page)
+        sink.flush()
+    for count in ( 1, 20 ):
+        benchmark(results, f's3_sink_write[objects={count}]', write_pages, \
+                  setup=lambda count=count: count, rounds=max(3, ARGS.ROUNDS // count))
+    sink.close()
+    server.shutdown()
+    return failures
+
+### runner ###
+
+def main():
+    """
+    Start the stub server, run every benchmark, then save and compare the results
+    """
+    server = StubServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = export_script.SumoApiClient('benchmark', 'benchmark', endpoint=server.endpoint)
+    payload = client.define_export_job('0000000000000001', timezone='UTC')
+    results = {}
+
+    print(f'{"name (milliseconds)":<40} {"min":>10} {"median":>10} {"mean":>10} ' + \
+          f'{"stddev":>10} {"ops/s":>10}')
+
+    for count in DASHBOARD_COUNTS:
+        server.set_dashboards(count)
+        benchmark(results, f'client_get_parse[dashboards={count}]', \
+                  lambda _none: client.dashboards())
+
+    for polls in POLL_COUNTS:
+        server.pending_polls = polls - 1
+        benchmark(results, f'poll_export_job[polls={polls}]', \
+                  lambda job_id, polls=polls: \
+                      client.poll_export_dashboard_job(job_id, tries=polls, seconds=0), \
+                  setup=lambda: client.export_dashboard(payload))
+
+    if Image is None:
+        print('Skipping PDF benchmarks: the PIL module is not installed')
+        return results
+
+    server.pending_polls = 0
+    server.pdf = build_fixture_pdf(1)
+    benchmark(results, 'run_export_job[pages=1]', \
+              lambda _none: client.run_export_job('0000000000000001', timezone='UTC', seconds=0))
+
+    for dpi in DPI_LEVELS:
+        page = build_fixture_pages(1, dpi=dpi)[0]
+        benchmark(results, f'jpeg_encode[dpi={dpi}]', lambda _none, page=page: \
+                  page.save(io.BytesIO(), 'JPEG'))
+
+    for pages in PAGE_COUNTS:
+        fixture = build_fixture_pdf(pages)
+        for dpi in DPI_LEVELS:
+            try:
+                benchmark(results, f'pdf2image[pages={pages},dpi={dpi}]', \
+                          lambda _none, fixture=fixture, dpi=dpi: \
+                              pdf2image.convert_from_bytes(fixture, dpi=dpi), \
+                          rounds=max(3, ARGS.ROUNDS // pages))
+            except pdf2image.exceptions.PDFInfoNotInstalledError:
+                print('Skipping pdf2image benchmarks: poppler is not installed')
+                return results
+
+    return results
+
+if __name__ == '__main__':
+    RESULTS = main()
+    FAILURES = 0
+    if ARGS.S3CHECK and export_script.boto3 is None:
+        print('Skipping S3 sink check: the boto3 module is not installed')
+    elif ARGS.S3CHECK:
+        FAILURES = check_s3_sink(RESULTS)
+    if ARGS.OUTPUT:
+        with open(ARGS.OUTPUT, 'w', encoding='utf8') as OUTPUTFILE:
+            json.dump(RESULTS, OUTPUTFILE, indent=1, sort_keys=True)
+        print(f'Saved Results: {ARGS.OUTPUT}')
+    if ARGS.BASELINE and compare_baseline(RESULTS, ARGS.BASELINE, ARGS.TOLERANCE):
+        sys.exit(1)
+    if FAILURES:
+        sys.exit(1)
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Exaplanation: sumologic_client is the shared Sumo Logic API client core for the scripts
+
+Usage:
+    from sumologic_client import SumoApiCore
+
+    class SumoApiClient(SumoApiCore):
+        ... cmdlets built on get/post/put/delete ...
+
+Style:
+    Google Python Style Guide:
+    http://google.github.io/styleguide/pyguide.html
+
+    @name           sumologic_client
+    @version        2.00
+    @author-name    Wayne Schmidt
+    @author-email   wschmidt@sumologic.com
+    @license-name   Apache 2.0
+    @license-url    https://www.apache.org/licenses/LICENSE-2.0
+"""
+
+__version__ = 2.00
+__author__ = "Wayne Schmidt (wschmidt@sumologic.com)"
+
+### beginning ###
+import sys
+import json
+import time
+import bisect
+import hashlib
+import threading
+import contextlib
+import collections
+import requests
+import requests.adapters
+import urllib3.util.retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_POOL_SIZE = 16
+
+DEFAULT_TIMEOUT = ( 10, 120 )
+
+DEFAULT_RETRIES = 3
+
+RETRY_STATUSES = ( 429, 502, 503, 504 )
+
+DISCOVERY_URL = 'https://api.sumologic.com/api/v1/collectors'
+
+ENDPOINT_CACHE = {}
+
+ENDPOINT_LOCK = threading.Lock()
+
+SHARD_REPLICAS = 1024
+
+SAMPLE_INTERVAL = 0.005
+
+def loads(payload):
+    """
+    Decode JSON from bytes or text, using orjson when it is installed
+    """
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+def dumps(payload):
+    """
+    Encode a request body as JSON, using orjson when it is installed
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload)
+
+def parse_shard(shard):
+    """
+    Parse a shard specification of the form i/N, with i counted from 1 to N
+    """
+    (index, _sep, count) = shard.partition('/')
+    (index, count) = (int(index), int(count))
+    if not 1 <= index <= count:
+        raise ValueError(f'Shard must be i/N with 1 <= i <= N: {shard}')
+    return index, count
+
+### beginning ###
+
+### profiling ###
+class StageTimer():
+    """
+    Thread safe totals of call count and seconds per named stage (http, json, rasterize...)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = collections.defaultdict(lambda: [0, 0.0])
+
+    def record(self, name, seconds):
+        """
+        Add one timed call to a stage
+        """
+        with self.lock:
+            self.totals[name][0] += 1
+            self.totals[name][1] += seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as one call of a stage
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self):
+        """
+        Return {stage: {calls, seconds}}
+        """
+        with self.lock:
+            return { name: {"calls": calls, "seconds": round(seconds, 6)} \
+                     for name, (calls, seconds) in sorted(self.totals.items()) }
+
+STAGES = StageTimer()
+
+class SamplingProfiler():
+    """
+    A sampling profiler covering every thread: a background thread reads the stack of all
+    other threads every interval and counts, per function, the samples where it was running
+    (self) and where it was anywhere on the stack (cumulative).
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.selfcounts = collections.Counter()
+        self.cumulative = collections.Counter()
+        self.running = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Start sampling
+        """
+        self.running.set()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and wait for the sampler thread
+        """
+        self.running.clear()
+        self.thread.join()
+
+    def sample(self):
+        """
+        Sampler loop
+        """
+        myself = threading.get_ident()
+        while self.running.is_set():
+            for thread_id, frame in sys._current_frames().items(): # pylint: disable=protected-access
+                if thread_id == myself:
+                    continue
+                self.samples += 1
+                seen = set()
+                leaf = True
+                while frame is not None:
+                    code = frame.f_code
+                    function = f'{code.co_filename}:{code.co_firstlineno}({code.co_name})'
+                    if leaf:
+                        self.selfcounts[function] += 1
+                        leaf = False
+                    if function not in seen:
+                        self.cumulative[function] += 1
+                        seen.add(function)
+                    frame = frame.f_back
+            time.sleep(self.interval)
+
+    def report(self, top=40):
+        """
+        Return the busiest functions by cumulative samples
+        """
+        return [ {"function": function, "cumulative": count, "self": self.selfcounts[function]} \
+                 for function, count in self.cumulative.most_common(top) ]
+
+def run_profiled(function, profilefile):
+    """
+    Run a script's main() under the sampling profiler, then write the stage totals and the
+    sampled functions to profilefile as JSON and print the stage totals
+    """
+    profiler = SamplingProfiler()
+    started = time.perf_counter()
+    profiler.start()
+    try:
+        function()
+    finally:
+        profiler.stop()
+        elapsed = time.perf_counter() - started
+        stages = STAGES.report()
+        profile = {
+            "seconds": round(elapsed, 6),
+            "interval": profiler.interval,
+            "samples": profiler.samples,
+            "stages": stages,
+            "functions": profiler.report()
+        }
+        with open(profilefile, 'w', encoding='utf8') as fileobject:
+            json.dump(profile, fileobject, indent=1)
+        print(f'Profile: {profilefile} seconds: {elapsed:.3f}')
+        for name, stage in stages.items():
+            print(f'stage: {name} calls: {stage["calls"]} seconds: {stage["seconds"]:.3f}')
+
+### profiling ###
+
+### shards ###
+class ShardRing():
+    """
+    Consistent hash ring mapping keys (dashboard ids) onto shards 1..N.
+    Each shard owns SHARD_REPLICAS points on the ring, so a key's shard depends only on
+    the key and N, and moving from N to N+1 shards reassigns about 1/(N+1) of the keys.
+    """
+    def __init__(self, count, replicas=SHARD_REPLICAS):
+        self.count = count
+        points = sorted((self.hash(f'shard-{shard}-{replica}'), shard) \
+                        for shard in range(1, count + 1) for replica in range(replicas))
+        self.points = [ point for point, _shard in points ]
+        self.shards = [ shard for _point, shard in points ]
+
+    @staticmethod
+    def hash(key):
+        """
+        Map a string to a 64 bit position on the ring
+        """
+        return int.from_bytes(hashlib.md5(str(key).encode('utf8')).digest()[:8], 'big')
+
+    def shard_of(self, key):
+        """
+        Return the shard (1..N) that owns a key
+        """
+        position = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.shards[position]
+
+    def select(self, keys, shard):
+        """
+        Return the keys owned by one shard, keeping their order
+        """
+        return [ key for key in keys if self.shard_of(key) == shard ]
+
+### shards ###
+
+### class ###
+class SumoApiCore():
+    """
+    This is the shared SumoLogic API Client core.
+    It owns the pooled HTTP session, endpoint discovery, versioned URLs, error handling,
+    timeouts, retries of idempotent calls, optional throttling and timing hooks.
+    Each hook is called as hook(verb, url, status, seconds, size) after every request.
+    """
+    def __init__(self, access_id, access_key, endpoint=None, ca_bundle=None, \
+                 default_version='v2', pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, \
+                 retries=DEFAULT_RETRIES, delay=0, headers=None):
+        self.session = requests.Session()
+        self.session.auth = (access_id, access_key)
+        self.session.headers.update(headers or {'content-type': 'application/json', \
+                                                'accept': 'application/json'})
+        if ca_bundle is not None:
+            self.session.verify = ca_bundle
+        retry = urllib3.util.retry.Retry(total=retries, backoff_factor=0.5, \
+                                         status_forcelist=RETRY_STATUSES, \
+                                         raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, \
+                                                pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.default_version = default_version
+        self.timeout = timeout
+        self.delay = delay
+        self.hooks = []
+        self.throttle_lock = threading.Lock()
+        self.last_request = 0.0
+        if endpoint is None:
+            self.endpoint = self._get_endpoint()
+        elif len(endpoint) < 3:
+            self.endpoint = 'https://api.' + endpoint + '.sumologic.com/api'
+        else:
+            self.endpoint = endpoint
+        if self.endpoint[-1:] == "/":
+            raise Exception("Endpoint should not end with a slash character")
+
+    def _get_endpoint(self):
+        """
+        SumoLogic REST API endpoint changes based on the geo location of the client.
+        This method makes a request to the default REST endpoint and resolves the 401 to learn
+        the right endpoint. The result is cached per access id for the life of the process.
+        """
+        access_id = self.session.auth[0]
+        with ENDPOINT_LOCK:
+            if access_id not in ENDPOINT_CACHE:
+                response = self.session.get(DISCOVERY_URL, timeout=self.timeout)
+                ENDPOINT_CACHE[access_id] = response.url.replace('/v1/collectors', '')
+        return ENDPOINT_CACHE[access_id]
+
+    def get_versioned_endpoint(self, version):
+        """
+        formats and returns the endpoint and version
+        """
+        return self.endpoint+f'/{version}'
+
+    def throttle(self):
+        """
+        Keep at least delay seconds between the start of consecutive requests
+        """
+        if not self.delay:
+            return
+        with self.throttle_lock:
+            wait = self.last_request + self.delay - time.monotonic()
+            if wait > 0:
+                STAGES.record('throttle', wait)
+                time.sleep(wait)
+            self.last_request = time.monotonic()
+
+    def request(self, verb, method, version=None, **kwargs):
+        """
+        Issue one HTTP request against the versioned endpoint and raise on 4xx and 5xx
+        """
+        version = version or self.default_version
+        url = self.get_versioned_endpoint(version) + method
+        self.throttle()
+        started = time.perf_counter()
+        response = self.session.request(verb, url, timeout=self.timeout, **kwargs)
+        elapsed = time.perf_counter() - started
+        STAGES.record('http', elapsed)
+        size = int(response.headers.get('Content-Length', 0)) if kwargs.get('stream') \
+               else len(response.content)
+        for hook in self.hooks:
+            hook(verb, url, response.status_code, elapsed, size)
+        if 400 <= response.status_code < 600:
+            response.reason = response.text
+        response.raise_for_status()
+        return response
+
+    def json(self, response):
+        """
+        Decode the JSON body of a response
+        """
+        with STAGES.stage('json'):
+            return loads(response.content)
+
+    def delete(self, method, params=None, headers=None, data=None, version=None):
+        """
+        HTTP delete
+        """
+        return self.request('DELETE', method, version=version, params=params, \
+                            headers=headers, data=None if data is None else dumps(data))
+
+    def get(self, method, params=None, headers=None, version=None, stream=False):
+        """
+        HTTP get; with stream=True the body is left unread for the caller to consume
+        """
+        return self.request('GET', method, version=version, params=params, headers=headers, \
+                            stream=stream)
+
+    def post(self, method, data=None, headers=None, params=None, version=None):
+        """
+        HTTP post
+        """
+        return self.request('POST', method, version=version, params=params, \
+                            headers=headers, data=None if data is None else dumps(data))
+
+    def put(self, method, data, headers=None, params=None, version=None):
+        """
+        HTTP put
+        """
+        return self.request('PUT', method, version=version, params=params, \
+                            headers=headers, data=dumps(data))
+
+    def post_file(self, method, params, headers=None, version=None):
+        """
+        Handle file uploads via a separate post request to avoid having to clear
+        the content-type header in the session.
+        Requests (or urllib3) does not set a boundary in the header if the content-type
+        is already set to multipart/form-data.  Urllib will create a boundary but it
+        won't be specified in the content-type header, producing invalid POST request.
+        Multi-threaded applications using self.session may experience issues if we
+        try to clear the content-type from the session.  Thus we don't re-use the
+        session for the upload, rather we create a new one off session.
+        """
+        version = version or self.default_version
+        endpoint = self.get_versioned_endpoint(version)
+        post_params = {'merge': params['merge']}
+        with open(params['full_file_path'], 'rb') as file_object:
+            file_data = file_object.read()
+        files = {'file': (params['file_name'], file_data)}
+        response = requests.post(endpoint + method, files=files, params=post_params, \
+                                 auth=(self.session.auth[0], self.session.auth[1]), \
+                                 headers=headers, timeout=self.timeout)
+        if 400 <= response.status_code < 600:
+            response.reason = response.text
+        response.raise_for_status()
+        return response
+
+### class ###
@@ -26,24 +26,65 @@ __version__ = 2.00
 __author__ = "Wayne Schmidt (wschmidt@sumologic.com)"
 
 ### beginning ###
+import io
+import csv
+import zlib
+import base64
 import json
 import os
+import re
 import sys
 import time
 import datetime
 import argparse
 import configparser
+import heapq
+import queue
+import itertools
+import functools
+import tempfile
+import contextlib
+import glob
+import statistics
+import threading
+import collections
+import socketserver
+import http.server
+import urllib.parse
+import concurrent.futures
 import tzlocal
 import requests
 import pdf2image
+import PIL.Image
 
 try:
-    import cookielib
+    import boto3
+    from boto3.s3.transfer import TransferConfig
 except ImportError:
-    import http.cookiejar as cookielib
+    boto3 = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 sys.dont_write_bytecode = 1
 
+from sumologic_client import SumoApiCore, DEFAULT_POOL_SIZE # pylint: disable=wrong-import-position
+from sumologic_client import ShardRing, parse_shard # pylint: disable=wrong-import-position
+from sumologic_client import STAGES, run_profiled # pylint: disable=wrong-import-position
+
 MY_CFG = 'undefined'
 PARSER = argparse.ArgumentParser(description="""
 sumologic_dashboard_export will extract out any and all dashboards you specify
@@ -56,16 +97,65 @@ PARSER.add_argument("-d", metavar='<dashboard>', dest='DASHBOARDLIST', \
                     action='append', help="set dashboard uid (list format)")
 
 PARSER.add_argument("-f", metavar='<fmt>', default="Pdf", dest='OFORMAT', \
-                    help="set query output")
+                    type=str.capitalize, choices=['Pdf', 'Png'], \
+                    help="set query output (Pdf or Png)")
 
 PARSER.add_argument('-c', metavar='<cfgfile>', dest='CONFIG', help='specify a config file')
 
 PARSER.add_argument("-o", metavar='<outdir>', default="/var/tmp/dashboardexport", \
-                    dest='CACHED', help="set query output directory")
+                    dest='CACHED', help="set query output directory (or s3://<bucket>/<prefix>)")
+
+PARSER.add_argument("-w", type=int, default=4, metavar='<workers>', \
+                    dest='WORKERS', help="set concurrent export jobs")
+
+PARSER.add_argument("-D", "--daemon", action='store_true', default=False, \
+                    dest='DAEMON', help="run as a service using the [Schedules] config section")
+
+PARSER.add_argument("-l", metavar='<[host:]port>', dest='LISTEN', \
+                    help="serve on-demand export requests over HTTP")
+
+PARSER.add_argument("-b", type=int, default=60, metavar='<seconds>', \
+                    dest='BUCKET', help="set time bucket for coalescing and caching requests")
+
+PARSER.add_argument("-x", metavar='<datafmt>', dest='DATAFORMAT', \
+                    choices=['ndjson', 'csv', 'parquet', 'arrow'], \
+                    help="export panel data instead of reports (ndjson, csv, parquet, arrow)")
+
+PARSER.add_argument("--diff", metavar='<previous_dir>', dest='DIFF', \
+                    help="compare panel data in the output directory against a previous run")
+
+PARSER.add_argument("-t", type=float, default=0.05, metavar='<threshold>', \
+                    dest='THRESHOLD', help="set relative change that counts as a breach")
+
+PARSER.add_argument("--changed", metavar='<report>', dest='CHANGED', \
+                    help="only export dashboards marked changed in a change report")
+
+PARSER.add_argument("-p", metavar='<fingerprints>', \
+                    default="/var/tmp/dashboardexport.fingerprints.json", \
+                    dest='FINGERPRINTS', help="set page fingerprint index ('none' to disable)")
+
+PARSER.add_argument("-P", type=float, default=0.005, metavar='<threshold>', \
+                    dest='PAGETHRESHOLD', help="set page difference score that counts as changed")
+
+PARSER.add_argument("--shard", metavar='<i/N>', dest='SHARD', \
+                    help="only export dashboards owned by shard i of N (consistent hashing)")
+
+PARSER.add_argument("-m", metavar='<historyfile>', \
+                    default="/var/tmp/dashboardexport.history.json", \
+                    dest='HISTORY', help="set render history store")
+
+PARSER.add_argument("--plan", action='store_true', default=False, \
+                    dest='PLAN', help="print the predicted wall time for -w workers and exit")
+
+PARSER.add_argument("-u", type=int, default=4, metavar='<uploaders>', \
+                    dest='UPLOADERS', help="set concurrent object storage uploads")
 
 PARSER.add_argument("-s", metavar='<sleeptime>', default=2, dest='SLEEPTIME', \
                     help="set sleep time to check results")
 
+PARSER.add_argument("--profile", metavar='<profilefile>', dest='PROFILE', \
+                    help="profile the run and write per stage statistics to a file")
+
 PARSER.add_argument("-v", type=int, default=0, metavar='<verbose>', \
                     dest='verbose', help="increase verbosity")
 
@@ -83,6 +173,28 @@ DATESTAMP = RIGHTNOW.strftime('%Y%m%d')
 
 TIMESTAMP = RIGHTNOW.strftime('%H%M%S')
 
+PRIORITIES = {'critical': 0, 'high': 1, 'normal': 2, 'low': 3}
+
+DEFAULT_ESTIMATE = 30
+
+HISTORY_SAMPLES = 20
+
+MAX_PRESLEEP = 30
+
+DATA_BATCH = 10000
+
+FINGERPRINT_SIZE = 256
+
+FINGERPRINT_TILE = 2
+
+DATA_COLUMNS = ( 'dashboard', 'panel', 'series', 'timestamp', 'value' )
+
+DEADLINE = re.compile(r'^([01]?[0-9]|2[0-3]):[0-5][0-9]$')
+
+EXPORT_FORMATS = {'pdf': 'Pdf', 'png': 'Png'}
+
+DASHBOARD_ID = re.compile(r'^[A-Za-z0-9]{1,64}$')
+
 def resolve_option_variables():
     """
     Validates and confirms all necessary variables for the script
@@ -114,6 +226,10 @@ def resolve_config_variables():
         if configobj.has_option("Default", "SUMO_KEY"):
             os.environ['SUMO_KEY'] = configobj.get("Default", "SUMO_KEY")
 
+        for s3_option in ( 'S3_ENDPOINT', 'S3_REGION', 'S3_ACCESS_KEY', 'S3_SECRET_KEY' ):
+            if configobj.has_option("Default", s3_option):
+                os.environ[s3_option] = configobj.get("Default", s3_option)
+
 def initialize_variables():
     """
     Validates and confirms all necessary variables for the script
@@ -123,33 +239,99 @@ def initialize_variables():
 
     resolve_config_variables()
 
+    my_uid = my_key = None
+
     try:
         my_uid = os.environ['SUMO_UID']
         my_key = os.environ['SUMO_KEY']
 
     except KeyError as myerror:
-        print(f'Environment Variable Not Set :: {myerror.args[0]}')
+        if not ARGS.PLAN:
+            print(f'Environment Variable Not Set :: {myerror.args[0]}')
 
     return my_uid, my_key
 
 ( sumo_uid, sumo_key ) = initialize_variables()
 
+def read_config():
+    """
+    Read the config file, if one was specified
+    """
+    configobj = configparser.ConfigParser(interpolation=None)
+    configobj.optionxform = str
+    if ARGS.CONFIG:
+        configobj.read(os.path.abspath(ARGS.CONFIG))
+    return configobj
+
+def parse_dashboard_entry(value):
+    """
+    Split a [Dashboards] value of the form: <name> | <key>=<value> | <key>=<value>
+    """
+    fields = [ field.strip() for field in value.split('|') ]
+    attributes = {'name': fields[0]}
+    for field in fields[1:]:
+        (key, _sep, attribute) = field.partition('=')
+        attributes[key.strip().lower()] = attribute.strip()
+    priority = attributes.get('priority', 'normal').lower()
+    if not priority.isdigit() and priority not in PRIORITIES:
+        raise ValueError('Priority must be a number or one of ' + \
+                         f'{", ".join(PRIORITIES)}: {value}')
+    if 'deadline' in attributes and not DEADLINE.match(attributes['deadline']):
+        raise ValueError(f'Deadline must be HH:MM (00:00 to 23:59): {value}')
+    return attributes
+
+def resolve_dashboardentries():
+    """
+    Resolve the dashboards to export along with their config attributes
+    """
+    dashboardentries = {}
+    if ARGS.DASHBOARDLIST:
+        for dashboard in ARGS.DASHBOARDLIST:
+            dashboardentries[dashboard] = {'name': dashboard}
+    else:
+        configobj = read_config()
+        if configobj.has_section("Dashboards"):
+            for dashboard, value in configobj.items('Dashboards'):
+                dashboardentries[dashboard] = parse_dashboard_entry(value)
+    if ARGS.SHARD:
+        (shard, shardcount) = parse_shard(ARGS.SHARD)
+        owned = ShardRing(shardcount).select(list(dashboardentries), shard)
+        dashboardentries = { dashboard: dashboardentries[dashboard] for dashboard in owned }
+    if ARGS.CHANGED:
+        with open(ARGS.CHANGED, 'r', encoding='utf8') as fileobject:
+            unchanged = set(json.load(fileobject)['unchanged'])
+        dashboardentries = { dashboard: attributes for dashboard, attributes \
+                             in dashboardentries.items() if dashboard not in unchanged }
+    return dashboardentries
+
 def resolve_dashboardlist():
     """
     Resolve dashboard list to export
     """
-    if ARGS.DASHBOARDLIST:
-        dashboardlist = ARGS.DASHBOARDLIST
+    return list(resolve_dashboardentries().keys())
+
+def resolve_dashboardgroups():
+    """
+    Resolve dashboard groups, using the group=<name> attribute in [Dashboards]
+    """
+    dashboardgroups = {}
+    for dashboard, attributes in resolve_dashboardentries().items():
+        group = attributes.get('group', 'default')
+        dashboardgroups.setdefault(group, []).append(dashboard)
+    return dashboardgroups
+
+def resolve_schedules():
+    """
+    Resolve the cron schedule per dashboard group from the [Schedules] config section
+    """
+    schedules = {}
+    configobj = read_config()
+    if configobj.has_section("Schedules"):
+        for group, expression in configobj.items('Schedules'):
+            schedules[group] = CronSchedule(expression)
     else:
-        if ARGS.CONFIG:
-            cfgfile = os.path.abspath(ARGS.CONFIG)
-            configobj = configparser.ConfigParser()
-            configobj.optionxform = str
-            configobj.read(cfgfile)
-            if configobj.has_section("Dashboards"):
-                dashboarddict = dict(configobj.items('Dashboards'))
-                dashboardlist = list(dashboarddict.keys())
-    return dashboardlist
+        schedules['default'] = CronSchedule('*/15 * * * *')
+    return schedules
 
 ### beginning ###
 
@@ -159,164 +341,1150 @@ def main():
     Once done, then issue the command required
     """
 
-    exporter=SumoApiClient(sumo_uid, sumo_key)
+    schedules = resolve_schedules() if read_config().has_section("Schedules") else None
+    planner = ExportPlanner(resolve_dashboardentries(), RenderHistory(ARGS.HISTORY), schedules)
+
+    if ARGS.PLAN:
+        planner.print_plan(resolve_dashboardlist(), ARGS.WORKERS)
+        return
+
+    if ARGS.DIFF and (CACHED.startswith('s3://') or ARGS.DIFF.startswith('s3://')):
+        raise Exception('--diff compares local directories; it cannot be used with s3:// output')
+
+    if ARGS.DIFF and not ARGS.DATAFORMAT:
+        compare_data_runs(ARGS.DIFF, CACHED, ARGS.THRESHOLD)
+        return
+
+    exporter=SumoApiClient(sumo_uid, sumo_key, \
+                           pool_size=max(DEFAULT_POOL_SIZE, ARGS.WORKERS))
+    if ARGS.verbose > 8:
+        exporter.hooks.append(print_request_timing)
 
     tzname = str(tzlocal.get_localzone())
 
-    os.makedirs(CACHED, exist_ok=True)
+    fingerprints = None
+    if ARGS.FINGERPRINTS.lower() != 'none' and numpy is not None:
+        fingerprints = PageFingerprints(ARGS.FINGERPRINTS)
 
-    dashboardlist = resolve_dashboardlist()
+    engine = ExportEngine(exporter, resolve_output_sink(CACHED), tzname, planner, \
+                          workers=ARGS.WORKERS, data_format=ARGS.DATAFORMAT, \
+                          fingerprints=fingerprints)
 
-    for dashboard in dashboardlist:
+    try:
+        if ARGS.LISTEN:
+            run_trigger_service(engine, ARGS.LISTEN, background=ARGS.DAEMON)
+        if ARGS.DAEMON:
+            run_daemon(engine, resolve_dashboardgroups(), resolve_schedules())
+        elif not ARGS.LISTEN:
+            results = engine.run(resolve_dashboardlist())
+            if ARGS.DIFF:
+                compare_data_runs(ARGS.DIFF, CACHED, ARGS.THRESHOLD)
+            if any(export['status'] != 'Success' for export in results):
+                sys.exit(1)
+    finally:
+        engine.close()
+
+def print_request_timing(verb, url, status, seconds, size):
+    """
+    Client hook printing the timing of each API request
+    """
+    print(f'request: {verb} {url} status: {status} seconds: {seconds:.3f} bytes: {size}')
+
+def run_daemon(engine, dashboardgroups, schedules):
+    """
+    Run the export engine on the cron schedule of each dashboard group, within one process.
+    The client session, endpoint and worker pools stay warm between ticks, and a group
+    whose previous run is still going is skipped rather than started twice.
+    """
+    grouplocks = { group: threading.Lock() for group in schedules }
+
+    print(f'Starting Daemon: groups: {", ".join(sorted(schedules))}')
+    while True:
+        moment = datetime.datetime.now().replace(second=0, microsecond=0) + \
+                 datetime.timedelta(minutes=1)
+        time.sleep(max(0, (moment - datetime.datetime.now()).total_seconds()))
+
+        for group, schedule in schedules.items():
+            if not schedule.matches(moment):
+                continue
+            dashboardlist = dashboardgroups.get(group, [])
+            if not dashboardlist:
+                continue
+            if not grouplocks[group].acquire(blocking=False):
+                print(f'Skipping Group: {group} previous run still active')
+                continue
+            if ARGS.verbose > 5:
+                print(f'Starting Group: {group} dashboards: {len(dashboardlist)}')
+            threading.Thread(target=run_daemon_group, daemon=True, \
+                             args=(engine, group, dashboardlist, grouplocks[group], \
+                                   moment)).start()
+
+def run_daemon_group(engine, group, dashboardlist, grouplock, scheduled=None):
+    """
+    Run one scheduled tick for a dashboard group and release its lock when done
+    """
+    try:
+        results = engine.run(dashboardlist, scheduled)
+        failed = [ export['id'] for export in results if export['status'] != 'Success' ]
+        missed = [ export['id'] for export in results if export.get('deadline_missed') ]
+        print(f'Finished Group: {group} exported: {len(results) - len(failed)} ' + \
+              f'failed: {len(failed)} missed deadlines: {len(missed)}')
+    except Exception as myerror: # pylint: disable=broad-except
+        print(f'Group: {group} Error: {myerror}')
+    finally:
+        grouplock.release()
+
+### history ###
+class RenderHistory():
+    """
+    A small JSON store of measured exports per dashboard: render seconds (report job start
+    to success), total seconds (including download, rasterize and write), output bytes and
+    page count. Only the most recent samples are kept.
+    """
+    def __init__(self, historyfile, samples=HISTORY_SAMPLES):
+        self.historyfile = historyfile
+        self.samples = samples
+        self.lock = threading.Lock()
+        self.records = {}
+        if os.path.exists(self.historyfile):
+            with open(self.historyfile, 'r', encoding='utf8') as fileobject:
+                self.records = json.load(fileobject)
+
+    def record(self, dashboard, render_seconds, total_seconds, size, pages):
+        """
+        Add one measured export for a dashboard
+        """
+        sample = {
+            "when": int(time.time()),
+            "render": round(render_seconds, 3),
+            "total": round(total_seconds, 3),
+            "bytes": size,
+            "pages": pages
+        }
+        with self.lock:
+            records = self.records.setdefault(dashboard, [])
+            records.append(sample)
+            del records[:-self.samples]
+
+    def predict(self, dashboard, field='total', shared=True):
+        """
+        Predict a field for a dashboard from the median of its recent samples. Dashboards
+        without history get the median over all dashboards, or a fixed default; with
+        shared=False they get None.
+        """
+        with self.lock:
+            samples = [ sample[field] for sample in self.records.get(dashboard, []) ]
+            if not samples and not shared:
+                return None
+            if not samples:
+                samples = [ statistics.median([ sample[field] for sample in records ]) \
+                            for records in self.records.values() if records ]
+        if not samples:
+            return DEFAULT_ESTIMATE if field in ('render', 'total') else 0
+        return statistics.median(samples)
+
+    def save(self):
+        """
+        Persist the store, replacing the previous file atomically
+        """
+        save_json(self.historyfile, self.records, self.lock, indent=1, sort_keys=True)
+
+def save_json(jsonfile, content, lock, **options):
+    """
+    Replace a JSON file atomically. The content is written to a unique temporary file in the
+    same directory and renamed over the old file, all under the lock guarding the content,
+    so concurrent saves from threads or processes never share a temporary file.
+    """
+    directory = os.path.dirname(os.path.abspath(jsonfile))
+    os.makedirs(directory, exist_ok=True)
+    with lock:
+        (descriptor, tempfile_name) = tempfile.mkstemp(dir=directory, suffix='.tmp', \
+                                          prefix=os.path.basename(jsonfile) + '.')
+        try:
+            with os.fdopen(descriptor, 'w', encoding='utf8') as fileobject:
+                json.dump(content, fileobject, **options)
+            os.replace(tempfile_name, jsonfile)
+        except BaseException:
+            os.unlink(tempfile_name)
+            raise
+
+### history ###
+
+### fingerprints ###
+class PageFingerprints():
+    """
+    An index of page fingerprints from the previous run, keyed by where each page was written.
+    A fingerprint is the page reduced to a FINGERPRINT_SIZE square of grayscale pixels. Two
+    fingerprints are scored by their worst FINGERPRINT_TILE square tile, so a change to one
+    small value or chart on a large page is not averaged away by the rest of the page.
+    """
+    def __init__(self, indexfile, size=FINGERPRINT_SIZE, tile=FINGERPRINT_TILE):
+        self.indexfile = indexfile
+        self.size = size
+        self.tile = tile
+        self.lock = threading.Lock()
+        self.index = {}
+        if os.path.exists(self.indexfile):
+            with open(self.indexfile, 'r', encoding='utf8') as fileobject:
+                self.index = json.load(fileobject)
+
+    def fingerprint(self, image):
+        """
+        Reduce a page image to its grayscale thumbnail array
+        """
+        thumbnail = image.convert('L').resize((self.size, self.size), PIL.Image.BOX)
+        return numpy.asarray(thumbnail, dtype=numpy.uint8)
+
+    def score(self, current, previous):
+        """
+        Return the mean absolute difference of the most changed tile (0.0 same to 1.0 inverted)
+        """
+        tiles = self.size // self.tile
+        difference = numpy.abs(current.astype(numpy.int16) - previous.astype(numpy.int16))
+        difference = difference.reshape(tiles, self.tile, tiles, self.tile)
+        return float(difference.mean(axis=(1, 3)).max() / 255)
+
+    def compare(self, key, image, threshold):
+        """
+        Score a page against the fingerprint last committed under key and return
+        (changed, score, fingerprint). The index is not updated here: commit() the
+        fingerprint once the page has been written.
+        """
+        current = self.fingerprint(image)
+        with self.lock:
+            previous = self.index.get(key)
+        score = 1.0
+        if previous is not None:
+            previous = numpy.frombuffer(zlib.decompress(base64.b64decode(previous)), \
+                                        dtype=numpy.uint8)
+            if previous.size == current.size:
+                score = self.score(current, previous.reshape(current.shape))
+        return score > threshold, score, current
+
+    def commit(self, key, fingerprint):
+        """
+        Store the fingerprint of a page that was written, so slow drift still adds up to a
+        change against the last emitted version
+        """
+        encoded = base64.b64encode(zlib.compress(fingerprint.tobytes())).decode('ascii')
+        with self.lock:
+            self.index[key] = encoded
+
+    def save(self):
+        """
+        Persist the index, replacing the previous file atomically
+        """
+        save_json(self.indexfile, self.index, self.lock, sort_keys=True)
+
+### fingerprints ###
+
+### planner ###
+class ExportPlanner():
+    """
+    Decides the order of export submissions from the [Dashboards] attributes and the render
+    history, and predicts how long a run takes for a given number of workers.
+    """
+    def __init__(self, entries, history, schedules=None):
+        self.entries = entries or {}
+        self.history = history
+        self.schedules = schedules or {}
+        self.due = {}
+
+    def estimate(self, dashboard):
+        """
+        Return the expected export duration of a dashboard in seconds
+        """
+        return self.history.predict(dashboard)
+
+    def priority(self, dashboard):
+        """
+        Return the priority rank of a dashboard; lower ranks are submitted first
+        """
+        priority = self.entries.get(dashboard, {}).get('priority', 'normal').lower()
+        if priority.isdigit():
+            return int(priority)
+        return PRIORITIES.get(priority, PRIORITIES['normal'])
+
+    def scheduled(self, dashboard, started):
+        """
+        Return when the run of a dashboard was due: the latest time in the day before the
+        start that matches the cron schedule of its group, or midnight without a schedule
+        """
+        group = self.entries.get(dashboard, {}).get('group', 'default')
+        started = started.replace(second=0, microsecond=0)
+        if (group, started) not in self.due:
+            due = started.replace(hour=0, minute=0)
+            schedule = self.schedules.get(group)
+            moment = started
+            for _minute in range(24 * 60 if schedule else 0):
+                if schedule.matches(moment):
+                    due = moment
+                    break
+                moment -= datetime.timedelta(minutes=1)
+            self.due[(group, started)] = due
+        return self.due[(group, started)]
+
+    def deadline(self, dashboard, started, scheduled=None):
+        """
+        Return the deadline=HH:MM of a dashboard for the run due at the scheduled time, if set.
+        This is the first HH:MM at or after the scheduled time, so a run that starts late is
+        still held to the deadline it was scheduled for.
+        """
+        deadline = self.entries.get(dashboard, {}).get('deadline')
+        if not deadline:
+            return None
+        scheduled = scheduled or self.scheduled(dashboard, started)
+        (hour, minute) = [ int(field) for field in deadline.split(':') ]
+        moment = scheduled.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if moment < scheduled:
+            moment += datetime.timedelta(days=1)
+        return moment
+
+    def queue_key(self, dashboard, started, scheduled=None):
+        """
+        Return the queue key of a dashboard: priority, then the latest time (epoch seconds)
+        it can start and still meet its deadline, then longest expected duration first.
+        Longest first within a class packs the jobs evenly across workers.
+        """
+        deadline = self.deadline(dashboard, started, scheduled)
+        estimate = self.estimate(dashboard)
+        latest = deadline.timestamp() - estimate if deadline else float('inf')
+        return (self.priority(dashboard), latest, -estimate)
+
+    def order_dashboards(self, dashboardlist, started, scheduled=None):
+        """
+        Order dashboards by their queue key
+        """
+        return sorted(dashboardlist, \
+                      key=lambda dashboard: self.queue_key(dashboard, started, scheduled))
+
+    def simulate(self, dashboardlist, workers, started=None):
+        """
+        Assign the ordered dashboards to the first free worker and return the schedule as
+        a list of (dashboard, worker, start offset, estimate) with the predicted wall time
+        """
+        started = started or datetime.datetime.now()
+        freeworkers = [ (0.0, worker) for worker in range(1, max(1, workers) + 1) ]
+        schedule = []
+        walltime = 0.0
+        for dashboard in self.order_dashboards(dashboardlist, started):
+            (offset, worker) = heapq.heappop(freeworkers)
+            estimate = self.estimate(dashboard)
+            schedule.append((dashboard, worker, offset, estimate))
+            walltime = max(walltime, offset + estimate)
+            heapq.heappush(freeworkers, (offset + estimate, worker))
+        return schedule, walltime
+
+    def print_plan(self, dashboardlist, workers):
+        """
+        Print the predicted schedule and wall time without contacting the API
+        """
+        started = datetime.datetime.now()
+        (schedule, walltime) = self.simulate(dashboardlist, workers, started)
+        print(f'Planned Exports: {len(schedule)} workers: {workers}')
+        print("dashboard_id,worker,start_seconds,predicted_seconds,deadline")
+        for (dashboard, worker, offset, estimate) in schedule:
+            deadline = self.deadline(dashboard, started)
+            deadline = f'{deadline:%H:%M}' if deadline else ''
+            print(f'{dashboard},{worker},{offset:.1f},{estimate:.1f},{deadline}')
+        serial = sum(item[3] for item in schedule)
+        print(f'Predicted Wall Time: {walltime:.1f}s (serial: {serial:.1f}s)')
+
+    def report_deadlines(self, results, started, scheduled=None):
+        """
+        Mark and report exports that finished after their deadline
+        """
+        for export in results:
+            deadline = self.deadline(export['id'], started, scheduled)
+            export['deadline_missed'] = bool(deadline) and \
+                (export['status'] != 'Success' or export['finished'] > deadline)
+            if export['deadline_missed']:
+                print(f'Missed Deadline: {export["id"]} deadline: {deadline:%H:%M} ' + \
+                      f'finished: {export["finished"]:%H:%M:%S} status: {export["status"]}')
+
+### planner ###
+
+### engine ###
+class ExportEngine():
+    """
+    Runs dashboard export jobs on a pool of workers and hands the results to an output sink.
+    One engine is meant to be kept for the life of the process so the API session and the
+    worker pool are reused across runs. Every run, daemon group and on-demand request feeds
+    one priority queue, so a critical job never waits behind queued jobs of lower priority.
+    """
+    def __init__(self, exporter, sink, tzname, planner, workers=4, data_format=None, \
+                 fingerprints=None):
+        self.exporter = exporter
+        self.sink = sink
+        self.tzname = tzname
+        self.planner = planner
+        self.workers = workers
+        self.data_format = data_format
+        self.fingerprints = fingerprints
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.threads = [ threading.Thread(target=self.work, daemon=True) \
+                         for _worker in range(max(1, workers)) ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, function, *args, **kwargs):
+        """
+        Queue function(*args, **kwargs) by key, lowest first, and return its future.
+        Jobs with equal keys run in the order they were submitted.
+        """
+        future = concurrent.futures.Future()
+        self.queue.put((key, next(self.sequence), future, function, args, kwargs))
+        return future
 
-        export = exporter.run_export_job(dashboard,timezone=tzname,export_format='Pdf')
+    def work(self):
+        """
+        Worker loop: run queued jobs until a stop marker arrives
+        """
+        while True:
+            (_key, _sequence, future, function, args, kwargs) = self.queue.get()
+            if future is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as myerror: # pylint: disable=broad-except
+                future.set_exception(myerror)
+
+    def export_dashboard(self, dashboard, export_format=OUTFORMAT, timezone=None):
+        """
+        Export one dashboard, write the result to the sink, and rasterize PDF pages
+        """
+        started = time.time()
+        export = self.exporter.run_export_job(dashboard, timezone=timezone or self.tzname, \
+                                              export_format=export_format, \
+                                              expected=self.planner.history.predict(dashboard, \
+                                                                       'render', shared=False))
 
         if export['status'] != 'Success':
             print(f'Job: {export["job"]} Status: {export["status"]}')
-            sys.exit()
+            export['finished'] = datetime.datetime.now()
+            return export
+
+        outputfile = f'{dashboard}.{export_format.lower()}'
+        print(f'Writing File: {self.sink.location(outputfile)}')
+        self.sink.write(outputfile, export['bytes'])
+
+        pages = 0
+        if export_format.lower() == 'pdf':
+            pages = rasterize_export(dashboard, export['bytes'], self.sink, self.fingerprints)
+        export['finished'] = datetime.datetime.now()
+        self.planner.history.record(dashboard, export['render_seconds'], time.time() - started, \
+                                    len(export['bytes']), pages)
+        return export
 
-        outputfile = f'{CACHED}/{dashboard}.{OUTFORMAT.lower()}'
-        print(f'Writing File: {outputfile}')
+    def export_data(self, dashboard):
+        """
+        Fetch the panel data of one dashboard and stream it to the sink as one row per
+        series point, written in batches of DATA_BATCH rows
+        """
+        panels = self.exporter.dashboard_data_panels(dashboard)
+        outputfile = f'{dashboard}.data.{self.data_format}'
+        print(f'Writing File: {self.sink.location(outputfile)}')
+        with self.sink.open_stream(outputfile) as fileobject, STAGES.stage('data'):
+            rows = write_data_rows(fileobject, self.data_format, \
+                                   iterate_data_rows(dashboard, panels))
+        return {
+            'id': dashboard,
+            'job': outputfile,
+            'status': 'Success',
+            'rows': rows,
+            'finished': datetime.datetime.now()
+        }
 
-        with open(outputfile, "wb") as fileobject:
-            fileobject.write(export['bytes'])
+    def run(self, dashboardlist, scheduled=None):
+        """
+        Export a list of dashboards concurrently and wait for their output to be written.
+        Deadlines are taken for the run due at the scheduled time (daemon tick), if given.
+        """
+        started = datetime.datetime.now()
+        task = self.export_data if self.data_format else self.export_dashboard
+        remaining = sum(self.planner.estimate(dashboard) for dashboard in dashboardlist)
+        futures = { self.submit(self.planner.queue_key(dashboard, started, scheduled), \
+                                task, dashboard): dashboard for dashboard in dashboardlist }
+        for completed, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            remaining -= self.planner.estimate(futures[future])
+            if ARGS.verbose > 3:
+                print(f'Progress: {completed}/{len(futures)} ' + \
+                      f'ETA: {max(0, remaining) / self.workers:.0f}s')
+        results = [ self.job_result(dashboard, future) for future, dashboard in futures.items() ]
+        try:
+            self.sink.flush()
+        finally:
+            self.planner.report_deadlines(results, started, scheduled)
+            self.planner.history.save()
+            if self.fingerprints is not None:
+                self.fingerprints.save()
+        return results
+
+    @staticmethod
+    def job_result(dashboard, future):
+        """
+        Return the result of a finished job; a job that raised becomes an Error result
+        """
+        try:
+            return future.result()
+        except Exception as myerror: # pylint: disable=broad-except
+            print(f'Job: {dashboard} Status: Error {myerror!r}')
+            return {
+                'id': dashboard,
+                'job': None,
+                'status': 'Error',
+                'error': str(myerror),
+                'finished': datetime.datetime.now()
+            }
 
-    for path in os.listdir(CACHED):
-        file_name = os.path.join(CACHED, path)
-        print(file_name)
-        if os.path.isfile(file_name):
-            extension = os.path.splitext(file_name)[1]
-            if extension == '.pdf':
-                images = pdf2image.convert_from_path(file_name)
-                for number, _imageitem in enumerate(images):
-                    image_name = file_name.replace('.pdf', '.' + str(number) + '.jpg')
-                    images[number].save(image_name, 'JPEG')
+    def close(self):
+        """
+        Let the workers finish the queued jobs, then shut down the output sink
+        """
+        for _thread in self.threads:
+            self.queue.put(((float('inf'),), next(self.sequence), None, None, (), {}))
+        for thread in self.threads:
+            thread.join()
+        self.sink.close()
+        self.planner.history.save()
+        if self.fingerprints is not None:
+            self.fingerprints.save()
+
+### engine ###
+
+### data ###
+def first_field(item, fields, default=None):
+    """
+    Return the first of several alternative keys present in a dict
+    """
+    for field in fields:
+        if field in item:
+            return item[field]
+    return default
 
-### class ###
-class SumoApiClient():
+def iterate_data_rows(dashboard, panels):
     """
-    This is defined SumoLogic API Client
-    The class includes the HTTP methods, cmdlets, and init methods
+    Flatten dashboard panel data into (dashboard, panel, series, timestamp, value) rows.
+    Points may be {x, y}, {timestamp, value} dicts or [timestamp, value] pairs.
     """
-    def __init__(self, access_id=sumo_uid, access_key=sumo_key, endpoint=None, \
-                 ca_bundle=None, cookie_file='cookies.txt'):
-        self.session = requests.Session()
-        self.session.auth = (access_id, access_key)
-        self.default_version = 'v2'
-        self.session.headers = {'content-type': 'application/json', 'accept': '*/*'}
-        if ca_bundle is not None:
-            self.session.verify = ca_bundle
-        cookiejar = cookielib.FileCookieJar(cookie_file)
-        self.session.cookies = cookiejar
-        if endpoint is None:
-            self.endpoint = self._get_endpoint()
-        elif len(endpoint) < 3:
-            self.endpoint = 'https://api.' + endpoint + '.sumologic.com/api'
+    for number, panel in enumerate(panels):
+        panel_id = first_field(panel, ('panelId', 'panelKey', 'id'), str(number))
+        for series in first_field(panel, ('series', 'timeSeries', 'data'), []) or []:
+            series_name = first_field(series, ('name', 'seriesName', 'metric', 'query'), '')
+            if not isinstance(series_name, str):
+                series_name = json.dumps(series_name, sort_keys=True)
+            for point in first_field(series, ('points', 'dataPoints', 'values'), []) or []:
+                if isinstance(point, dict):
+                    timestamp = first_field(point, ('x', 'timestamp', 'time'))
+                    value = first_field(point, ('y', 'value'))
+                else:
+                    (timestamp, value) = point[0], point[1]
+                yield (dashboard, panel_id, series_name, timestamp, value)
+
+def batched(rows, size=DATA_BATCH):
+    """
+    Group an iterator of rows into lists of at most size rows
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def write_data_rows(fileobject, data_format, rows):
+    """
+    Stream rows into a binary file object as ndjson, csv, parquet or arrow; return the count
+    """
+    count = 0
+    if data_format in ('parquet', 'arrow'):
+        if pyarrow is None:
+            raise Exception(f'The {data_format} data format requires the pyarrow module')
+        schema = pyarrow.schema([ ('dashboard', pyarrow.string()), ('panel', pyarrow.string()), \
+                                  ('series', pyarrow.string()), ('timestamp', pyarrow.int64()), \
+                                  ('value', pyarrow.float64()) ])
+        if data_format == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(fileobject, schema)
+        else:
+            writer = pyarrow.ipc.new_file(fileobject, schema)
+        with writer:
+            for batch in batched(rows):
+                columns = [ list(column) for column in zip(*batch) ]
+                columns[1] = [ str(panel) for panel in columns[1] ]
+                writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+                count += len(batch)
+        return count
+
+    textobject = io.TextIOWrapper(fileobject, encoding='utf8', newline='')
+    if data_format == 'csv':
+        csvwriter = csv.writer(textobject)
+        csvwriter.writerow(DATA_COLUMNS)
+    for batch in batched(rows):
+        if data_format == 'csv':
+            csvwriter.writerows(batch)
+        else:
+            textobject.writelines(json.dumps(dict(zip(DATA_COLUMNS, row))) + '\n' \
+                                  for row in batch)
+        count += len(batch)
+    textobject.flush()
+    textobject.detach()
+    return count
+
+def read_data_rows(datafile):
+    """
+    Read back the rows of a panel data file written by write_data_rows
+    """
+    data_format = os.path.splitext(datafile)[1][1:]
+    if data_format in ('parquet', 'arrow'):
+        if pyarrow is None:
+            raise Exception(f'The {data_format} data format requires the pyarrow module')
+        if data_format == 'parquet':
+            table = pyarrow.parquet.read_table(datafile)
         else:
-            self.endpoint = endpoint
-        if self.endpoint[-1:] == "/":
-            raise Exception("Endpoint should not end with a slash character")
+            with pyarrow.ipc.open_file(datafile) as reader:
+                table = reader.read_all()
+        yield from zip(*[ table.column(column).to_pylist() for column in DATA_COLUMNS ])
+        return
+    with open(datafile, 'r', encoding='utf8', newline='') as fileobject:
+        if data_format == 'csv':
+            reader = csv.reader(fileobject)
+            next(reader, None)
+            yield from reader
+        else:
+            for line in fileobject:
+                row = json.loads(line)
+                yield tuple(row[column] for column in DATA_COLUMNS)
+
+def load_data_arrays(datafile):
+    """
+    Load a panel data file into NumPy arrays: panel+series keys, timestamps and values
+    """
+    keys = []
+    timestamps = []
+    values = []
+    for (_dashboard, panel, series, timestamp, value) in read_data_rows(datafile):
+        keys.append(f'{panel}\x1f{series}')
+        timestamps.append(float(timestamp))
+        values.append(numpy.nan if value in (None, '') else float(value))
+    return numpy.array(keys, dtype=str), numpy.array(timestamps, dtype=numpy.float64), \
+           numpy.array(values, dtype=numpy.float64)
+
+def compare_data_arrays(previous, current, threshold):
+    """
+    Compare two runs of one dashboard. Points are matched on (panel+series, timestamp) and
+    per panel the matched, added and removed points, threshold breaches and the absolute
+    deltas are computed with array operations.
+    """
+    (old_keys, old_times, old_values) = previous
+    (new_keys, new_times, new_values) = current
+
+    (vocabulary, key_ids) = numpy.unique(numpy.concatenate([old_keys, new_keys]), \
+                                         return_inverse=True)
+    (old_ids, new_ids) = (key_ids[:len(old_keys)], key_ids[len(old_keys):])
+    (panels, panel_of_key) = numpy.unique([ key.split('\x1f')[0] for key in vocabulary ], \
+                                          return_inverse=True)
+
+    pointtype = [ ('key', numpy.int64), ('timestamp', numpy.float64) ]
+    old_points = numpy.empty(len(old_ids), dtype=pointtype)
+    old_points['key'], old_points['timestamp'] = old_ids, old_times
+    new_points = numpy.empty(len(new_ids), dtype=pointtype)
+    new_points['key'], new_points['timestamp'] = new_ids, new_times
+    (common, old_index, new_index) = numpy.intersect1d(old_points, new_points, \
+                                                       return_indices=True)
+
+    (before, after) = (old_values[old_index], new_values[new_index])
+    delta = numpy.abs(after - before)
+    bothmissing = numpy.isnan(before) & numpy.isnan(after)
+    relative = delta / numpy.maximum(numpy.abs(before), 1e-9)
+    breach = ~(relative <= threshold) & ~bothmissing
+    delta = numpy.where(numpy.isnan(delta), 0.0, delta)
+
+    panelcount = len(panels)
+    matched_panels = panel_of_key[common['key']]
+    matched = numpy.bincount(matched_panels, minlength=panelcount)
+    breaches = numpy.bincount(matched_panels, weights=breach, minlength=panelcount)
+    total_delta = numpy.bincount(matched_panels, weights=delta, minlength=panelcount)
+    max_delta = numpy.zeros(panelcount)
+    numpy.maximum.at(max_delta, matched_panels, delta)
+    removed = numpy.bincount(panel_of_key[old_ids], minlength=panelcount) - matched
+    added = numpy.bincount(panel_of_key[new_ids], minlength=panelcount) - matched
+
+    report = {}
+    for number, panel in enumerate(panels):
+        report[str(panel)] = {
+            "matched": int(matched[number]),
+            "added": int(added[number]),
+            "removed": int(removed[number]),
+            "breaches": int(breaches[number]),
+            "max_abs_delta": float(max_delta[number]),
+            "mean_abs_delta": float(total_delta[number] / matched[number]) \
+                              if matched[number] else 0.0,
+            "changed": bool(breaches[number] or added[number] or removed[number])
+        }
+    return report
 
-    def _get_endpoint(self):
+def compare_data_runs(previous_dir, current_dir, threshold):
+    """
+    Compare the panel data files of two runs, write changes.json to the current run
+    directory and return the report. Dashboards without a previous file count as changed.
+    """
+    if numpy is None:
+        raise Exception('Comparing panel data requires the numpy module')
+    for directory in ( previous_dir, current_dir ):
+        if not os.path.isdir(directory):
+            raise Exception(f'Comparing panel data requires local directories: {directory}')
+    report = {"threshold": threshold, "dashboards": {}, "changed": [], "unchanged": []}
+    for datafile in sorted(glob.glob(os.path.join(current_dir, '*.data.*'))):
+        dashboard = os.path.basename(datafile).split('.data.')[0]
+        previous = os.path.join(previous_dir, os.path.basename(datafile))
+        panels = {}
+        if os.path.exists(previous):
+            panels = compare_data_arrays(load_data_arrays(previous), \
+                                         load_data_arrays(datafile), threshold)
+        changed = not os.path.exists(previous) or \
+                  any(panel['changed'] for panel in panels.values())
+        report['dashboards'][dashboard] = {"changed": changed, "panels": panels}
+        report['changed' if changed else 'unchanged'].append(dashboard)
+
+    reportfile = os.path.join(current_dir, 'changes.json')
+    with open(reportfile, 'w', encoding='utf8') as fileobject:
+        json.dump(report, fileobject, indent=1, sort_keys=True)
+    print(f'Changed Dashboards: {len(report["changed"])} ' + \
+          f'unchanged: {len(report["unchanged"])} report: {reportfile}')
+    return report
+
+### data ###
+
+### trigger ###
+class ExportCoalescer():
+    """
+    Front end for on-demand exports. Requests for the same dashboard, format, timezone and
+    time bucket share one report job while it runs, and its result is served from cache for
+    the rest of the bucket. A client is waiting, so new jobs are queued at the dashboard's
+    priority with a latest start of now.
+    """
+    def __init__(self, engine, bucket=60, max_cached=64):
+        self.engine = engine
+        self.bucket = max(1, bucket)
+        self.max_cached = max_cached
+        self.lock = threading.RLock()
+        self.inflight = {}
+        self.cached = collections.OrderedDict()
+
+    def request_key(self, dashboard, export_format, timezone):
         """
-        SumoLogic REST API endpoint changes based on the geo location of the client.
-        This method makes a request to the default REST endpoint and resolves the 401 to learn
-        the right endpoint
+        Build the coalescing key for a request
         """
-        self.endpoint = 'https://api.sumologic.com/api'
-        self.response = self.session.get('https://api.sumologic.com/api/v1/collectors')
-        endpoint = self.response.url.replace('/v1/collectors', '')
-        return endpoint
+        return (dashboard, export_format.lower(), timezone, int(time.time() // self.bucket))
 
-    def get_versioned_endpoint(self, version):
+    def request(self, dashboard, export_format=OUTFORMAT, timezone=None):
+        """
+        Return (export, source) where source is one of: cached, coalesced, started
         """
-        formats and returns the endpoint and version
+        timezone = timezone or self.engine.tzname
+        key = self.request_key(dashboard, export_format, timezone)
+        with self.lock:
+            if key in self.cached:
+                self.cached.move_to_end(key)
+                return self.cached[key], 'cached'
+            if key in self.inflight:
+                future = self.inflight[key]
+                source = 'coalesced'
+            else:
+                planner = self.engine.planner
+                queue_key = (planner.priority(dashboard), time.time(), \
+                             -planner.estimate(dashboard))
+                future = self.engine.submit(queue_key, self.engine.export_dashboard, dashboard, \
+                                            export_format=export_format, timezone=timezone)
+                self.inflight[key] = future
+                future.add_done_callback(lambda done: self.complete(key, done))
+                source = 'started'
+        return future.result(), source
+
+    def complete(self, key, future):
         """
-        return self.endpoint+f'/{version}'
+        Move a finished job from the in-flight table into the cache
+        """
+        with self.lock:
+            self.inflight.pop(key, None)
+            if future.exception() is not None or future.result()['status'] != 'Success':
+                return
+            current = int(time.time() // self.bucket)
+            for stale in [ item for item in self.cached if item[3] < current ]:
+                del self.cached[stale]
+            self.cached[key] = future.result()
+            while len(self.cached) > self.max_cached:
+                self.cached.popitem(last=False)
+
+class TriggerServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Threaded HTTP server carrying the shared export coalescer
+    """
+    daemon_threads = True
+
+    def __init__(self, address, coalescer):
+        self.coalescer = coalescer
+        http.server.HTTPServer.__init__(self, address, TriggerHandler)
 
-    def delete(self, method, params=None, version=None):
+class TriggerHandler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /export?dashboard=<id>[&format=Pdf][&timezone=<tz>] returns the exported file.
+    GET /health returns ok.
+    """
+    def do_GET(self): # pylint: disable=invalid-name
         """
-        HTTP delete
+        Dispatch a GET request
         """
-        version = version or self.default_version
-        endpoint = self.get_versioned_endpoint(version)
-        response = self.session.delete(endpoint + method, params=params)
-        if 400 <= response.status_code < 600:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/health':
+            self.reply(200, b'ok\n', 'text/plain')
+        elif url.path == '/export':
+            self.handle_export(query)
+        else:
+            self.reply(404, b'not found\n', 'text/plain')
 
-    def get(self, method, params=None, version=None):
+    def handle_export(self, query):
         """
-        HTTP get
+        Run or join the export for the requested dashboard and return its bytes
         """
-        version = version or self.default_version
-        endpoint = self.get_versioned_endpoint(version)
-        response = self.session.get(endpoint + method, params=params)
-        if 400 <= response.status_code < 600:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
+        if 'dashboard' not in query:
+            self.reply(400, b'missing dashboard parameter\n', 'text/plain')
+            return
+        dashboard = query['dashboard'][0]
+        export_format = EXPORT_FORMATS.get(query.get('format', [OUTFORMAT])[0].lower())
+        timezone = query.get('timezone', [None])[0]
+        if not DASHBOARD_ID.match(dashboard):
+            self.reply(400, b'invalid dashboard parameter\n', 'text/plain')
+            return
+        if export_format is None:
+            message = f'format must be one of: {", ".join(EXPORT_FORMATS.values())}\n'
+            self.reply(400, message.encode('utf8'), 'text/plain')
+            return
+        try:
+            (export, source) = self.server.coalescer.request(dashboard, \
+                                   export_format=export_format, timezone=timezone)
+        except Exception as myerror: # pylint: disable=broad-except
+            status = 502 if isinstance(myerror, requests.exceptions.RequestException) else 500
+            print(f'Export Failed: {dashboard} status: {status} error: {myerror!r}')
+            self.reply(status, f'{myerror}\n'.encode('utf8'), 'text/plain')
+            return
+        if export['status'] != 'Success':
+            message = f'Job: {export["job"]} Status: {export["status"]}\n'
+            self.reply(502, message.encode('utf8'), 'text/plain')
+            return
+        self.reply(200, export['bytes'], export['format'], \
+                   {'X-Export-Job': export['job'], 'X-Export-Source': source})
 
-    def get_file(self, method, params=None, version=None, headers=None):
+    def reply(self, status, payload, content_type, headers=None):
         """
-        HTTP get file
+        Send a complete response
         """
-        version = version or self.default_version
-        endpoint = self.get_versioned_endpoint(version)
-        response = self.session.get(endpoint + method, params=params, headers=headers)
-        if 400 <= response.status_code < 600:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        if ARGS.verbose > 5:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def run_trigger_service(engine, listen, background=False):
+    """
+    Serve on-demand export requests on [host:]port, bound to localhost by default
+    """
+    (host, _sep, port) = str(listen).rpartition(':')
+    server = TriggerServer((host or '127.0.0.1', int(port)), \
+                           ExportCoalescer(engine, bucket=ARGS.BUCKET))
+    print(f'Serving Exports: http://{host or "127.0.0.1"}:{port}/export?dashboard=<id>')
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+### trigger ###
 
-    def post(self, method, params, headers=None, version=None):
+### schedule ###
+class CronSchedule():
+    """
+    A five field cron expression: minute hour day-of-month month day-of-week.
+    Fields accept *, numbers, ranges (a-b), steps (*/n, a-b/n) and comma lists.
+    """
+    LIMITS = ( (0, 59), (0, 23), (1, 31), (1, 12), (0, 7) )
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs five fields: {expression}')
+        self.expression = expression
+        self.restricted = [ field != '*' for field in fields ]
+        self.fields = [ self.parse_field(field, low, high) \
+                        for field, (low, high) in zip(fields, self.LIMITS) ]
+        if 7 in self.fields[4]:
+            self.fields[4].add(0)
+
+    @staticmethod
+    def parse_field(field, low, high):
         """
-        HTTP post
+        Expand one cron field into the set of values it matches
         """
-        version = version or self.default_version
-        endpoint = self.get_versioned_endpoint(version)
-        response = self.session.post(endpoint + method, data=json.dumps(params), headers=headers)
-        if 400 <= response.status_code < 600:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
+        values = set()
+        for item in field.split(','):
+            (span, _sep, step) = item.partition('/')
+            if span == '*':
+                (first, last) = (low, high)
+            elif '-' in span:
+                (first, last) = [ int(bound) for bound in span.split('-', 1) ]
+            else:
+                first = last = int(span)
+                if step:
+                    last = high
+            if first < low or last > high or first > last:
+                raise ValueError(f'Cron field out of range: {field}')
+            values.update(range(first, last + 1, int(step) if step else 1))
+        return values
+
+    def matches(self, moment):
+        """
+        Check whether a datetime (at minute resolution) is on this schedule
+        """
+        (minutes, hours, days, months, weekdays) = self.fields
+        weekday = (moment.weekday() + 1) % 7
+        day_of_month = moment.day in days
+        day_of_week = weekday in weekdays
+        if self.restricted[2] and self.restricted[4]:
+            day_matches = day_of_month or day_of_week
+        else:
+            day_matches = day_of_month and day_of_week
+        return moment.minute in minutes and moment.hour in hours and \
+               moment.month in months and day_matches
 
-    def post_file(self, method, params, headers=None, version=None):
-        """
-        Handle file uploads via a separate post request to avoid having to clear
-        the content-type header in the session.
-        Requests (or urllib3) does not set a boundary in the header if the content-type
-        is already set to multipart/form-data.  Urllib will create a boundary but it
-        won't be specified in the content-type header, producing invalid POST request.
-        Multi-threaded applications using self.session may experience issues if we
-        try to clear the content-type from the session.  Thus we don't re-use the
-        session for the upload, rather we create a new one off session.
-        """
-        version = version or self.default_version
-        endpoint = self.get_versioned_endpoint(version)
-        post_params = {'merge': params['merge']}
-        with open(params['full_file_path'], 'rb', encoding='utf8') as file_object:
-            file_data = file_object.read()
-        files = {'file': (params['file_name'], file_data)}
-        response = requests.post(endpoint + method, files=files, params=post_params,
-                auth=(self.session.auth[0], self.session.auth[1]), headers=headers)
-        if 400 <= response.status_code < 600:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
+### schedule ###
 
-    def put(self, method, params, headers=None, version=None):
+def rasterize_export(dashboard, payload, sink, fingerprints=None):
+    """
+    Convert the exported PDF into one JPEG per page, hand each page to the sink,
+    and return the page count. With a fingerprint index, pages that look the same as
+    the last page written to the same location are neither encoded nor written, and
+    a page's fingerprint is only recorded once the sink has persisted it.
+    """
+    with STAGES.stage('rasterize'):
+        images = pdf2image.convert_from_bytes(payload)
+    for number, imageitem in enumerate(images):
+        image_name = f'{dashboard}.{number}.jpg'
+        location = sink.location(image_name)
+        done = None
+        if fingerprints is not None:
+            with STAGES.stage('fingerprint'):
+                (changed, score, fingerprint) = fingerprints.compare(location, imageitem, \
+                                                                     ARGS.PAGETHRESHOLD)
+            if not changed and sink.exists(image_name):
+                if ARGS.verbose > 5:
+                    print(f'Unchanged Page: {location} score: {score:.4f}')
+                continue
+            done = functools.partial(fingerprints.commit, location, fingerprint)
+        buffer = io.BytesIO()
+        with STAGES.stage('jpeg'):
+            imageitem.save(buffer, 'JPEG')
+        print(f'Writing File: {location}')
+        sink.write(image_name, buffer.getvalue(), done)
+    return len(images)
+
+def resolve_output_sink(target):
+    """
+    Choose the output sink from the output target: s3://<bucket>/<prefix> or a directory
+    """
+    if target.startswith('s3://'):
+        (bucket, _sep, prefix) = target[len('s3://'):].partition('/')
+        return S3Sink(bucket, prefix, endpoint=os.environ.get('S3_ENDPOINT'), \
+                      workers=ARGS.UPLOADERS)
+    return LocalSink(target)
+
+### sinks ###
+class OutputSink():
+    """
+    An output sink receives each finished artifact as a name and a byte payload.
+    write() may return before the artifact is persisted; close() waits for all of them.
+    """
+    def write(self, name, payload, done=None):
         """
-        HTTP put
+        Persist one artifact and call done() once it is persisted
         """
-        version = version or self.default_version
-        endpoint = self.get_versioned_endpoint(version)
-        response = self.session.put(endpoint + method, data=json.dumps(params), headers=headers)
-        if 400 <= response.status_code < 600:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
+        raise NotImplementedError
+
+    def location(self, name):
+        """
+        Return where an artifact ends up, for display
+        """
+        raise NotImplementedError
+
+    def exists(self, name):
+        """
+        Check whether an artifact is present in the sink
+        """
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def open_stream(self, name):
+        """
+        Yield a binary file object for an artifact written incrementally
+        """
+        fileobject = io.BytesIO()
+        yield fileobject
+        self.write(name, fileobject.getvalue())
+
+    def flush(self):
+        """
+        Wait for outstanding writes
+        """
+
+    def close(self):
+        """
+        Wait for outstanding writes and release resources
+        """
+        self.flush()
+
+class LocalSink(OutputSink):
+    """
+    Writes artifacts into a local directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def location(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self, name):
+        return os.path.exists(self.location(name))
+
+    def write(self, name, payload, done=None):
+        with open(self.location(name), "wb") as fileobject, STAGES.stage('write'):
+            fileobject.write(payload)
+        if done is not None:
+            done()
+
+    @contextlib.contextmanager
+    def open_stream(self, name):
+        with open(self.location(name), "wb") as fileobject:
+            yield fileobject
+
+class S3Sink(OutputSink):
+    """
+    Uploads artifacts to S3 compatible object storage (AWS S3, MinIO, Ceph).
+    Each write is queued on a thread pool as soon as it arrives, so uploads overlap with
+    the remaining exports. Large payloads are sent as multipart uploads with part_workers
+    parts in flight, so at most workers * part_workers upload threads run at once.
+    """
+    def __init__(self, bucket, prefix='', endpoint=None, workers=4, \
+                 chunksize=8 * 1024 * 1024, part_workers=2):
+        if boto3 is None:
+            raise Exception("The s3:// output target requires the boto3 module")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint, \
+                                   region_name=os.environ.get('S3_REGION'), \
+                                   aws_access_key_id=os.environ.get('S3_ACCESS_KEY'), \
+                                   aws_secret_access_key=os.environ.get('S3_SECRET_KEY'))
+        self.transfer = TransferConfig(multipart_threshold=chunksize, \
+                                       multipart_chunksize=chunksize, \
+                                       max_concurrency=part_workers, use_threads=True)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def key(self, name):
+        """
+        Return the object key for an artifact
+        """
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def location(self, name):
+        return f's3://{self.bucket}/{self.key(name)}'
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except self.client.exceptions.ClientError:
+            return False
+        return True
+
+    def upload(self, name, payload):
+        """
+        Upload one artifact, using multipart transfers above the chunk size
+        """
+        with STAGES.stage('upload'):
+            self.client.upload_fileobj(io.BytesIO(payload), self.bucket, self.key(name), \
+                                       Config=self.transfer)
+        if ARGS.verbose > 5:
+            print(f'Uploaded: {self.location(name)} bytes: {len(payload)}')
+        return name
+
+    def upload_file(self, name, fileobject):
+        """
+        Upload a spooled artifact from disk and discard the local copy
+        """
+        try:
+            fileobject.seek(0)
+            with STAGES.stage('upload'):
+                self.client.upload_fileobj(fileobject, self.bucket, self.key(name), \
+                                           Config=self.transfer)
+        finally:
+            fileobject.close()
+        return name
+
+    def write(self, name, payload, done=None):
+        with self.lock:
+            future = self.executor.submit(self.upload, name, payload)
+            self.pending.append(future)
+        if done is not None:
+            future.add_done_callback(lambda future: future.exception() is None and done())
+
+    @contextlib.contextmanager
+    def open_stream(self, name):
+        fileobject = tempfile.TemporaryFile()
+        try:
+            yield fileobject
+        except BaseException:
+            fileobject.close()
+            raise
+        with self.lock:
+            self.pending.append(self.executor.submit(self.upload_file, name, fileobject))
+
+    def flush(self):
+        with self.lock:
+            (pending, self.pending) = (self.pending, [])
+        for future in concurrent.futures.as_completed(pending):
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+### sinks ###
+
+### class ###
+class SumoApiClient(SumoApiCore):
+    """
+    This is defined SumoLogic API Client
+    The class includes the dashboard cmdlets; HTTP methods come from SumoApiCore
+    """
+    def __init__(self, access_id=sumo_uid, access_key=sumo_key, endpoint=None, \
+                 ca_bundle=None, pool_size=DEFAULT_POOL_SIZE):
+        SumoApiCore.__init__(self, access_id, access_key, endpoint=endpoint, \
+                             ca_bundle=ca_bundle, pool_size=pool_size, \
+                             headers={'content-type': 'application/json', 'accept': '*/*'})
 
     def dashboards(self, monitors=False):
         """
@@ -324,28 +1492,42 @@ class SumoApiClient():
         """
         params = {'monitors': monitors}
         response = self.get('/dashboards', params)
-        return json.loads(response.text)['dashboards']
+        return self.json(response)['dashboards']
 
     def dashboard(self, dashboard_id):
         """
         Return details on a specific dashboard
         """
         response = self.get('/dashboards/' + str(dashboard_id))
-        return json.loads(response.text)['dashboard']
+        return self.json(response)['dashboard']
 
     def dashboard_data(self, dashboard_id):
         """
         Return data from a specific dashboard
         """
         response = self.get('/dashboards/' + str(dashboard_id) + '/data')
-        return json.loads(response.text)['dashboardMonitorDatas']
+        return self.json(response)['dashboardMonitorDatas']
+
+    def dashboard_data_panels(self, dashboard_id):
+        """
+        Yield the panel data of a specific dashboard one panel at a time. With ijson the
+        response is parsed as it arrives, so only one panel is held in memory; without it
+        the whole response is loaded first.
+        """
+        if ijson is None:
+            yield from self.dashboard_data(dashboard_id)
+            return
+        response = self.get('/dashboards/' + str(dashboard_id) + '/data', stream=True)
+        with contextlib.closing(response):
+            response.raw.decode_content = True
+            yield from ijson.items(response.raw, 'dashboardMonitorDatas.item', use_float=True)
 
     def export_dashboard(self,body):
         """
         Export data from a specific dashboard via a defined job
         """
-        response = self.post('/dashboards/reportJobs', params=body, version='v2')
-        job_id = json.loads(response.text)['id']
+        response = self.post('/dashboards/reportJobs', data=body, version='v2')
+        job_id = self.json(response)['id']
         if ARGS.verbose > 5:
             print(f'Started Job: {job_id}')
         return job_id
@@ -356,7 +1538,7 @@ class SumoApiClient():
         """
         response = self.get(f'/dashboards/reportJobs/{job_id}/status', version='v2')
         response = {
-            "result": json.loads(response.text),
+            "result": self.json(response),
             "job": job_id
         }
         return response
@@ -365,7 +1547,7 @@ class SumoApiClient():
         """
         Retrieve the results of a defined export job
         """
-        response = self.get_file(f"/dashboards/reportJobs/{job_id}/result", version='v2', \
+        response = self.get(f"/dashboards/reportJobs/{job_id}/result", version='v2', \
                                  headers={'content-type': 'application/json', 'accept': '*/*'})
         response = {
             "job": job_id,
@@ -393,12 +1575,20 @@ class SumoApiClient():
         }
         return payload
 
-    def poll_export_dashboard_job(self,job_id,tries=60,seconds=MY_SLEEP):
+    def poll_export_dashboard_job(self,job_id,tries=60,seconds=MY_SLEEP,expected=None):
         """
-        Iterate and check on the dashboard export job
+        Iterate and check on the dashboard export job.
+        With an expected render time, the first check waits for most of it (at most
+        MAX_PRESLEEP seconds).
         """
         progress = ''
         tried=0
+        started = time.time()
+
+        presleep = min(expected * 0.8, MAX_PRESLEEP) if expected else 0
+        if presleep:
+            with STAGES.stage('poll_wait'):
+                time.sleep(presleep)
 
         while progress != 'Success' and tried < tries:
             tried += 1
@@ -406,7 +1596,10 @@ class SumoApiClient():
             progress = response['result']['status']
             if ARGS.verbose > 7:
                 print(f'job: {job_id} status: {progress} tries: {tried} sleep: {seconds}')
-            time.sleep(seconds)
+            if progress != 'Success':
+                with STAGES.stage('poll_wait'):
+                    time.sleep(seconds)
+        completed = time.time()
 
         if ARGS.verbose > 5:
             print(f'{tried}/{tries} job: {job_id} status: {progress}')
@@ -415,18 +1608,27 @@ class SumoApiClient():
         response['seconds'] = tried * seconds
         response['tries'] = tries
         response['max_seconds'] = tries * seconds
+        response['elapsed'] = completed - started
+        response['completed'] = completed
+        response['presleep'] = presleep
         return response
 
     def run_export_job(self,report_id,timezone="America/Los_Angeles", \
-                       export_format='Pdf',tries=30,seconds=MY_SLEEP):
+                       export_format='Pdf',tries=30,seconds=MY_SLEEP,expected=None):
         """
-        Run the defined dashboard export job
+        Run the defined dashboard export job. The render time runs from the job start to
+        the first check that sees it finished. When that is the check right after the first
+        poll wait, it is an upper bound, and the next wait (80% of the median) shrinks
+        towards the real render time.
         """
+        started = time.time()
         payload = self.define_export_job(report_id,timezone=timezone,export_format=export_format)
         job = self.export_dashboard(payload)
         if ARGS.verbose > 7:
             print (f'Running Job: {job}')
-        poll_status = self.poll_export_dashboard_job(job,tries=tries,seconds=seconds)
+        poll_status = self.poll_export_dashboard_job(job,tries=tries,seconds=seconds, \
+                                                     expected=expected)
+        render_seconds = poll_status['completed'] - started
         if poll_status['result']['status'] == 'Success':
             export = self.get_export_dashboard_result(job)
         else:
@@ -437,9 +1639,13 @@ class SumoApiClient():
         export['id'] = report_id
         export['status'] = poll_status['result']['status']
         export['poll_status'] = poll_status
+        export['render_seconds'] = render_seconds
         return export
 
 ### class ###
 
 if __name__ == '__main__':
-    main()
+    if ARGS.PROFILE:
+        run_profiled(main, ARGS.PROFILE)
+    else:
+        main()
@@ -23,17 +23,16 @@ __version__ = 2.00
 __author__ = "Wayne Schmidt (wschmidt@sumologic.com)"
 
 ### beginning ###
-import json
 import os
 import sys
-import time
 import datetime
 import argparse
 import configparser
-import http
-import requests
 sys.dont_write_bytecode = 1
 
+from sumologic_client import SumoApiCore, run_profiled # pylint: disable=wrong-import-position
+from sumologic_client import ShardRing, parse_shard # pylint: disable=wrong-import-position
+
 MY_CFG = 'undefined'
 PARSER = argparse.ArgumentParser(description="""
 sumologic_dashboard_list shows all of the dashboards and their OID
@@ -48,6 +47,15 @@ PARSER.add_argument("-k", metavar='<client>', dest='MY_CLIENT', \
 PARSER.add_argument("-c", metavar='<cfg>', dest='CONFIG', \
                     help="Specify config file")
 
+PARSER.add_argument("-F", metavar='<folder>', dest='FOLDER', \
+                    help="only list dashboards within a folder subtree")
+
+PARSER.add_argument("--shard", metavar='<i/N>', dest='SHARD', \
+                    help="only list dashboards owned by shard i of N (consistent hashing)")
+
+PARSER.add_argument("--profile", metavar='<profilefile>', dest='PROFILE', \
+                    help="profile the run and write per stage statistics to a file")
+
 PARSER.add_argument("-v", type=int, default=0, metavar='<verbose>', \
                     dest='verbose', help="increase verbosity")
 
@@ -135,6 +143,8 @@ DATESTAMP = RIGHTNOW.strftime('%Y%m%d')
 
 TIMESTAMP = RIGHTNOW.strftime('%H%M%S')
 
+DASHBOARD_PAGE = 100
+
 
 ### beginning ###
 
@@ -148,7 +158,19 @@ def main():
     print("uid_myself,uid_parent,dashboard_id,my_name")
 
     dashboard_output = source.list_dashboards()
-    for dashboard_item in dashboard_output['dashboards']:
+    dashboard_items = dashboard_output['dashboards']
+
+    if ARGS.FOLDER:
+        folders = source.list_folder_tree(ARGS.FOLDER)
+        dashboard_items = [ item for item in dashboard_items if item['folderId'] in folders ]
+
+    if ARGS.SHARD:
+        (shard, shardcount) = parse_shard(ARGS.SHARD)
+        ring = ShardRing(shardcount)
+        dashboard_items = [ item for item in dashboard_items \
+                            if ring.shard_of(item['id']) == shard ]
+
+    for dashboard_item in dashboard_items:
         m_oid = dashboard_item['contentId']
         p_oid = dashboard_item['folderId']
         db_id = dashboard_item['id']
@@ -156,84 +178,17 @@ def main():
         print(f'{m_oid},{p_oid},{db_id},{db_name}')
 
 ### class ###
-class SumoApiClient():
+class SumoApiClient(SumoApiCore):
     """
     This is defined SumoLogic API Client
-    The class includes the HTTP methods, cmdlets, and init methods
+    The class includes the content and dashboard cmdlets; HTTP methods come from SumoApiCore
     """
 
-    def __init__(self, access_id, access_key, endpoint=None, cookie_file='cookies.txt'):
+    def __init__(self, access_id, access_key, endpoint=None):
         """
         Initializes the Sumo Logic object
         """
-        self.session = requests.Session()
-        self.session.auth = (access_id, access_key)
-        self.session.headers = {'content-type': 'application/json', \
-            'accept': 'application/json'}
-        cookiejar = http.cookiejar.FileCookieJar(cookie_file)
-        self.session.cookies = cookiejar
-        if endpoint is None:
-            self.apipoint = self._get_endpoint()
-        elif len(endpoint) < 3:
-            self.apipoint = 'https://api.' + endpoint + '.sumologic.com/api'
-        else:
-            self.apipoint = endpoint
-        if self.apipoint[-1:] == "/":
-            raise Exception("Endpoint should not end with a slash character")
-
-    def _get_endpoint(self):
-        """
-        SumoLogic REST API endpoint changes based on the geo location of the client.
-        It contacts the default REST endpoint and resolves the 401 to get the right endpoint.
-        """
-        self.endpoint = 'https://api.sumologic.com/api'
-        self.response = self.session.get('https://api.sumologic.com/api/v1/collectors')
-        endpoint = self.response.url.replace('/v1/collectors', '')
-        return endpoint
-
-    def delete(self, method, params=None, headers=None, data=None):
-        """
-        Defines a Sumo Logic Delete operation
-        """
-        response = self.session.delete(self.apipoint + method, \
-            params=params, headers=headers, data=data)
-        if response.status_code != 200:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
-
-    def get(self, method, params=None, headers=None):
-        """
-        Defines a Sumo Logic Get operation
-        """
-        response = self.session.get(self.apipoint + method, \
-            params=params, headers=headers)
-        if response.status_code != 200:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
-
-    def post(self, method, data=None, headers=None, params=None):
-        """
-        Defines a Sumo Logic Post operation
-        """
-        response = self.session.post(self.apipoint + method, \
-            data=json.dumps(data), headers=headers, params=params)
-        if response.status_code != 200:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
-
-    def put(self, method, data, headers=None, params=None):
-        """
-        Defines a Sumo Logic Put operation
-        """
-        response = self.session.put(self.apipoint + method, \
-            data=json.dumps(data), headers=headers, params=params)
-        if response.status_code != 200:
-            response.reason = response.text
-        response.raise_for_status()
-        return response
+        SumoApiCore.__init__(self, access_id, access_key, endpoint=endpoint, delay=DELAY_TIME)
 
 ### class ###
 ### methods ###
@@ -242,90 +197,108 @@ class SumoApiClient():
         """
         This should get the results
         """
-        url = "/v2/content/" + str(myself) + "/export/" + str(myjobid) + "/result"
-        body = self.get(url).text
-        results = json.loads(body)
-        time.sleep(DELAY_TIME)
+        url = "/content/" + str(myself) + "/export/" + str(myjobid) + "/result"
+        response = self.get(url)
+        results = self.json(response)
         return results
 
     def export_content_status(self, myself, myjobid):
         """
         This should get the status
         """
-        url = "/v2/content/" + str(myself) + "/export/" + str(myjobid) + "/status"
-        body = self.get(url).text
-        results = json.loads(body)
-        time.sleep(DELAY_TIME)
+        url = "/content/" + str(myself) + "/export/" + str(myjobid) + "/status"
+        response = self.get(url)
+        results = self.json(response)
         return results
 
-    def list_dashboards(self):
+    def list_dashboards(self, limit=DASHBOARD_PAGE):
         """
-        Show all of the dashboards
+        Show all of the dashboards, following the next token across every page
         """
-        url = "/v2/dashboards"
-        body = self.get(url).text
-        results = json.loads(body)
-        time.sleep(DELAY_TIME)
-        return results
+        url = "/dashboards"
+        params = {'limit': limit}
+        dashboards = []
+        while True:
+            response = self.get(url, params=params)
+            results = self.json(response)
+            dashboards.extend(results.get('dashboards', []))
+            if not results.get('next'):
+                break
+            params['token'] = results['next']
+        return {'dashboards': dashboards}
 
     def list_dashboard(self, myself):
         """
         Show all of the dashboards
         """
-        url = "/v2/dashboards/" + str(myself)
-        body = self.get(url).text
-        results = json.loads(body)
-        time.sleep(DELAY_TIME)
+        url = "/dashboards/" + str(myself)
+        response = self.get(url)
+        results = self.json(response)
         return results
 
+    def list_folder_tree(self, myself):
+        """
+        Return the ids of a folder and all of its sub folders
+        """
+        folders = set()
+        pending = [ str(myself) ]
+        while pending:
+            folder_id = pending.pop()
+            folders.add(folder_id)
+            for child in self.get_myfolder(folder_id).get('children', []):
+                if child.get('itemType') == 'Folder' and child['id'] not in folders:
+                    pending.append(child['id'])
+        return folders
+
     def export_content(self, myself):
         """
         Launch an export job. This should return a JOBID.
         """
-        url = "/v2/content/" + str(myself) + "/export"
-        body = self.post(url).text
-        results = json.loads(body)
-        time.sleep(DELAY_TIME)
+        url = "/content/" + str(myself) + "/export"
+        response = self.post(url)
+        results = self.json(response)
         return results
 
     def get_myfolders(self):
         """
         Using an HTTP client, this uses a GET to retrieve all connection information.
         """
-        url = "/v2/content/folders/personal/"
-        body = self.get(url).text
-        results = json.loads(body)
+        url = "/content/folders/personal/"
+        response = self.get(url)
+        results = self.json(response)
         return results
 
     def get_myfolder(self, myself):
         """
         Using an HTTP client, this uses a GET to retrieve single connection information.
         """
-        url = "/v2/content/folders/" + str(myself)
-        body = self.get(url).text
-        results = json.loads(body)
-        time.sleep(DELAY_TIME)
+        url = "/content/folders/" + str(myself)
+        response = self.get(url)
+        results = self.json(response)
         return results
 
     def get_globalfolders(self):
         """
         Using an HTTP client, this uses a GET to retrieve all connection information.
         """
-        url = "/v2/content/folders/global"
-        body = self.get(url).text
-        results = json.loads(body)
+        url = "/content/folders/global"
+        response = self.get(url)
+        results = self.json(response)
         return results
 
     def get_globalfolder(self, myself):
         """
         Using an HTTP client, this uses a GET to retrieve single connection information.
         """
-        url = "/v2/content/folders/global/" + str(myself)
-        body = self.get(url).text
-        results = json.loads(body)
+        url = "/content/folders/global/" + str(myself)
+        response = self.get(url)
+        results = self.json(response)
         return results
 
 ### methods ###
 
 if __name__ == '__main__':
-    main()
+    if ARGS.PROFILE:
+        run_profiled(main, ARGS.PROFILE)
+    else:
+        main()